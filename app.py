@@ -2,21 +2,17 @@ from flask import Flask, render_template, jsonify, request, flash, redirect, url
 from flask_cors import CORS
 import json
 import os
-import threading
 import logging
 from werkzeug.utils import secure_filename
-from core.sync_engine import SyncEngine
 from core.auth import authenticate, authenticate_with_code, get_auth_url, is_authenticated, clear_credentials
-from ui.tray import create_tray_icon
+from core.ipc import EngineClient, EngineUnavailable, spawn_worker
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
 CORS(app)
 
-# Global variables
-sync_engine = None
-tray_icon = None
-sync_thread = None
+# The sync engine runs in its own worker process and is controlled over IPC
+engine = EngineClient()
 
 def load_config():
     """Load configuration from config.json"""
@@ -28,9 +24,7 @@ def load_config():
         return None
 
 def start_sync_engine():
-    """Start the sync engine in a separate thread"""
-    global sync_engine, sync_thread
-    
+    """Start the sync engine worker process"""
     config = load_config()
     if not config:
         return False
@@ -39,19 +33,7 @@ def start_sync_engine():
         logging.error(f"Local folder does not exist: {config['local_folder']}")
         return False
     
-    # Initialize sync engine
-    sync_engine = SyncEngine(
-        local_folder=config['local_folder'],
-        drive_folder_name=config['drive_folder'],
-        ignore_patterns=config.get('ignore_patterns', [])
-    )
-    
-    # Start sync engine in a separate thread
-    sync_thread = threading.Thread(target=sync_engine.start)
-    sync_thread.daemon = True
-    sync_thread.start()
-    
-    return True
+    return spawn_worker()
 
 @app.route('/')
 def index():
@@ -61,31 +43,31 @@ def index():
 @app.route('/api/status')
 def get_status():
     """Get sync status"""
-    global sync_engine
-    
-    if sync_engine is None:
+    try:
+        return jsonify(engine.status())
+    except EngineUnavailable:
         return jsonify({
             'status': 'stopped',
             'message': 'Sync engine not started'
         })
-    
-    return jsonify({
-        'status': 'running',
-        'local_folder': sync_engine.local_folder,
-        'drive_folder': sync_engine.drive_folder_name
-    })
+
+@app.route('/api/events')
+def get_events():
+    """Get engine log events newer than the given event ID of the given worker"""
+    try:
+        since = request.args.get('since', 0, type=int)
+        reply = engine.events(since, request.args.get('boot_id'))
+        return jsonify({'boot_id': reply['boot_id'], 'events': reply['events']})
+    except EngineUnavailable:
+        return jsonify({'boot_id': None, 'events': []})
 
 @app.route('/api/sync', methods=['POST'])
 def manual_sync():
     """Trigger manual sync"""
-    global sync_engine
-    
-    if sync_engine is None:
-        return jsonify({'error': 'Sync engine not started'}), 400
-    
     try:
-        threading.Thread(target=sync_engine.poll_drive_changes).start()
-        return jsonify({'message': 'Manual sync triggered'})
+        return jsonify(engine.sync_now())
+    except EngineUnavailable:
+        return jsonify({'error': 'Sync engine not started'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -101,7 +83,8 @@ def get_config():
 def update_config():
     """Update configuration"""
     try:
-        new_config = request.json
+        # Merge so settings the web form doesn't edit (e.g. max_watches) are kept
+        new_config = {**(load_config() or {}), **request.json}
         with open('config.json', 'w') as f:
             json.dump(new_config, f, indent=2)
         return jsonify({'message': 'Configuration updated'})
@@ -111,9 +94,15 @@ def update_config():
 @app.route('/api/start', methods=['POST'])
 def start_sync():
     """Start the sync engine"""
-    global sync_engine
-    
-    if sync_engine is not None:
+    try:
+        status = engine.status()
+    except EngineUnavailable:
+        status = None
+    if status is not None:
+        if status['status'] == 'stopping':
+            return jsonify({'error': 'Sync engine is still stopping, try again in a moment'}), 400
+        if status['status'] == 'error':
+            return jsonify({'error': f"Sync engine failed: {status['message']}. Stop it before starting again"}), 400
         return jsonify({'error': 'Sync engine already running'}), 400
     
     success = start_sync_engine()
@@ -125,23 +114,15 @@ def start_sync():
 @app.route('/api/stop', methods=['POST'])
 def stop_sync():
     """Stop the sync engine"""
-    global sync_engine, tray_icon
-    
-    if sync_engine is None:
+    try:
+        engine.stop()
+    except EngineUnavailable:
         return jsonify({'error': 'Sync engine not running'}), 400
-    
-    # Stop tray icon if running
-    if tray_icon:
-        tray_icon.stop()
-    
-    # Stop sync engine
-    sync_engine.stop()
-    sync_engine = None
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
     
     return jsonify({'message': 'Sync engine stopped'})
 
-
-
 @app.route('/api/auth/status')
 def check_auth_status():
     """Check if user is authenticated"""
@@ -218,8 +199,16 @@ def main():
         print("Please follow the OAUTH_SETUP.md guide to set up your credentials.")
         print("="*60 + "\n")
     
-    # Start the Flask app
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    # Serve with waitress when available; the engine lives in its own process,
+    # so request threads never compete with sync work for the GIL
+    try:
+        from waitress import serve
+    except ImportError:
+        logger.info("waitress not installed, using the Flask development server")
+        app.run(host='0.0.0.0', port=8080, threaded=True,
+                debug=os.environ.get('FLASK_DEBUG') == '1')
+        return
+    serve(app, host='0.0.0.0', port=8080, threads=8)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
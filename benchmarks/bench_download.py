@@ -0,0 +1,105 @@
+"""Compare single-stream and multi-range downloads against a fake Drive backend.
+
+The fake backend serves files.get?alt=media with Range support and simulates
+a high-latency route: every request waits one round trip before the first
+byte, and each connection sends at most --window bytes per round trip, which
+caps single-connection throughput at window / rtt like a TCP window does.
+
+    python benchmarks/bench_download.py --size-mb 16 --rtt-ms 50 --connections 4
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from google.auth.credentials import AnonymousCredentials  # noqa: E402
+from googleapiclient.discovery import build  # noqa: E402
+from core.drive_api import DriveAPI  # noqa: E402
+
+
+def make_handler(payload, rtt, window):
+    class FakeDriveMediaHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if not re.match(r'^(/drive/v3)?/files/[^/?]+\?(.*&)?alt=media', self.path):
+                self.send_error(404)
+                return
+
+            start, end = 0, len(payload) - 1
+            match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('range', ''))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), end) if match.group(2) else end
+            body = payload[start:end + 1]
+
+            time.sleep(rtt)
+            self.send_response(206 if match else 200)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(payload)}')
+            self.end_headers()
+            for offset in range(0, len(body), window):
+                self.wfile.write(body[offset:offset + window])
+                time.sleep(rtt)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeDriveMediaHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=16)
+    parser.add_argument('--rtt-ms', type=float, default=50)
+    parser.add_argument('--window-kb', type=int, default=256)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--chunk-mb', type=int, default=2)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+    expected = hashlib.md5(payload).hexdigest()
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), make_handler(payload, args.rtt_ms / 1000, args.window_kb * 1024))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    api = DriveAPI(AnonymousCredentials())
+    api.service = build(
+        'drive', 'v3', credentials=AnonymousCredentials(),
+        client_options={'api_endpoint': f'http://127.0.0.1:{server.server_port}/'}
+    )
+    chunk_size = args.chunk_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        target = os.path.join(tmp_dir, 'download.bin')
+        cases = [
+            ('single stream', lambda: api.download_file('fake', target, chunk_size=chunk_size)),
+            (f'{args.connections} connections', lambda: api.download_file_ranges(
+                'fake', target, len(payload), connections=args.connections, chunk_size=chunk_size)),
+        ]
+
+        timings = []
+        for name, download in cases:
+            start = time.perf_counter()
+            if not download():
+                sys.exit(f"{name} download failed")
+            elapsed = time.perf_counter() - start
+            with open(target, 'rb') as f:
+                if hashlib.md5(f.read()).hexdigest() != expected:
+                    sys.exit(f"{name} download is corrupt")
+            timings.append(elapsed)
+            print(f"{name:<16} {elapsed:7.2f} s  {args.size_mb / elapsed:7.1f} MB/s")
+
+    print(f"speedup          {timings[0] / timings[1]:7.2f}x")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Compare memory use of the compact FileIndex with the old dict-of-dicts index.
+
+Builds both structures for the same synthetic tree and reports the bytes
+allocated per file (via tracemalloc) plus lookup and directory-listing time.
+
+    python benchmarks/bench_index_memory.py --files 500000
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from core.file_index import FileIndex  # noqa: E402
+
+LOCAL_FOLDER = os.path.join(os.sep, 'home', 'user', 'SyncFolder')
+
+
+def synthetic_paths(count, files_per_dir=50, dirs_per_dir=20):
+    """Yield relative paths spread over a few levels of nested directories"""
+    for i in range(count):
+        dir_id = i // files_per_dir
+        parts = []
+        while True:
+            parts.append(f'dir_{dir_id % dirs_per_dir:02d}')
+            dir_id //= dirs_per_dir
+            if not dir_id:
+                break
+        yield os.path.join(*reversed(parts), f'document_{i:08d}.txt')
+
+
+def build_dict_index(rows):
+    """The previous SyncHandler.file_index layout"""
+    index = {}
+    for rel_path, size, modified, file_hash in rows:
+        index[rel_path] = {
+            'path': os.path.join(LOCAL_FOLDER, rel_path),
+            'size': size,
+            'modified': modified,
+            'hash': file_hash
+        }
+    return index
+
+
+def build_file_index(rows):
+    index = FileIndex()
+    for rel_path, size, modified, file_hash in rows:
+        index.set(rel_path, size, modified, file_hash)
+    return index
+
+
+def measure(build, rows):
+    """Return the structure and the bytes it holds after construction"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    structure = build(rows)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return structure, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=200000)
+    args = parser.parse_args()
+
+    def rows():
+        # Fresh strings for every build, as os.walk and get_file_hash produce them
+        for i, rel_path in enumerate(synthetic_paths(args.files)):
+            yield rel_path, i * 37 % 100000, 1700000000.0 + i, hashlib.md5(rel_path.encode()).hexdigest()
+
+    sample = list(synthetic_paths(args.files))[::max(1, args.files // 10000)]
+    sample_dir = os.path.dirname(sample[len(sample) // 2])
+
+    results = []
+    for name, build in (('dict of dicts', build_dict_index), ('FileIndex', build_file_index)):
+        structure, allocated = measure(build, rows())
+
+        # The scanner's per-file check: FileIndex.stat, or a plain dict lookup
+        lookup = structure.stat if isinstance(structure, FileIndex) else structure.get
+        start = time.perf_counter()
+        for rel_path in sample:
+            lookup(rel_path)
+        lookup_us = (time.perf_counter() - start) / len(sample) * 1e6
+
+        start = time.perf_counter()
+        if isinstance(structure, FileIndex):
+            listed = structure.iter_dir(sample_dir)
+        else:
+            listed = [p for p in structure if os.path.dirname(p) == sample_dir]
+        list_ms = (time.perf_counter() - start) * 1000
+
+        results.append(allocated)
+        print(f"{name:<14} {allocated / 2**20:9.1f} MiB  {allocated / args.files:7.0f} B/file  "
+              f"lookup {lookup_us:5.2f} us  list dir ({len(listed)} files) {list_ms:8.2f} ms")
+        del structure
+
+    print(f"reduction      {results[0] / results[1]:9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Measure cold startup cost of the daemon and web UI entry points.
+
+Each case runs in a fresh interpreter so import caches don't hide regressions.
+The engine case also counts the Drive requests SyncEngine.start() makes before
+local change detection is running, using a stub Drive API and a cached folder
+ID. Pass --max-seconds to exit non-zero when any case is slower than the
+budget, or when the engine makes a Drive request before local work.
+
+    python benchmarks/bench_startup.py --repeat 5 --max-seconds 1.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CASES = {
+    'import sync_daemon': 'import sync_daemon',
+    'import app': 'import app',
+    'import core.sync_engine': 'import core.sync_engine',
+    'DriveAPI()': (
+        'from google.auth.credentials import AnonymousCredentials\n'
+        'from core.drive_api import DriveAPI\n'
+        'DriveAPI(AnonymousCredentials())'
+    ),
+}
+
+# Prints "<seconds> <drive requests>" measured up to the start of local change detection
+ENGINE_START = """
+import logging, os, sys, tempfile, threading, time
+logging.basicConfig(handlers=[logging.NullHandler()])
+import core.sync_engine as sync_engine
+from core.change_detector import HybridChangeDetector
+
+requests = []
+class StubDriveAPI:
+    def __init__(self, creds):
+        pass
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            requests.append(name)
+            return None
+        return call
+
+state_dir = tempfile.mkdtemp()
+local_folder = os.path.join(state_dir, 'local')
+os.makedirs(local_folder)
+for i in range(100):
+    with open(os.path.join(local_folder, f'file_{i}.txt'), 'w') as f:
+        f.write(str(i))
+sync_engine.authenticate = lambda: None
+sync_engine.DriveAPI = StubDriveAPI
+sync_engine.SyncEngine.load_cached_folder_id = lambda self: 'cached-folder-id'
+sync_engine.JOURNAL_FILE = os.path.join(state_dir, 'journal.log')
+sync_engine.SCAN_STATE_FILE = os.path.join(state_dir, 'scan_state.bin')
+sync_engine.INDEX_STATE_FILE = os.path.join(state_dir, 'index_state.bin')
+
+ready = threading.Event()
+measured = []
+original_start = HybridChangeDetector.start
+def start(self):
+    measured.append((time.perf_counter() - began, len(requests)))
+    original_start(self)
+    ready.set()
+HybridChangeDetector.start = start
+
+began = time.perf_counter()
+engine = sync_engine.SyncEngine(local_folder, 'Drive Sync')
+thread = threading.Thread(target=engine.start)
+thread.start()
+ready.wait()
+engine.stop()
+thread.join()
+print(*measured[0])
+"""
+
+
+def time_case(code):
+    """Run code in a fresh interpreter and return the wall time in seconds"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_case('pass') for _ in range(args.repeat))
+    print(f"{'interpreter startup':<26} {baseline * 1000:8.1f} ms")
+
+    failed = False
+    for name, code in CASES.items():
+        median = statistics.median(time_case(code) for _ in range(args.repeat))
+        print(f"{name:<26} {median * 1000:8.1f} ms")
+        if args.max_seconds is not None and median > args.max_seconds:
+            failed = True
+
+    output = subprocess.run([sys.executable, '-c', ENGINE_START], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout.split()
+    seconds, drive_requests = float(output[0]), int(output[1])
+    print(f"{'SyncEngine local work':<26} {seconds * 1000:8.1f} ms  "
+          f"({drive_requests} Drive requests before it)")
+    if args.max_seconds is not None and (seconds > args.max_seconds or drive_requests):
+        failed = True
+
+    if failed:
+        print(f"Startup budget of {args.max_seconds}s exceeded")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
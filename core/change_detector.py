@@ -0,0 +1,476 @@
+import os
+import sys
+import errno
+import select
+import struct
+import ctypes
+import queue
+import logging
+import threading
+from collections import OrderedDict, deque
+from watchdog.observers import Observer
+from .utils import atomic_write, write_state_header, read_state_header, read_exact
+
+try:
+    from watchdog.observers.inotify_c import (
+        InotifyConstants, inotify_init, inotify_add_watch, inotify_rm_watch
+    )
+except Exception:
+    # inotify is Linux-only; other platforms fall back to a recursive Observer
+    InotifyConstants = None
+
+DEFAULT_MAX_WATCHES = 8192
+SCAN_STATE_MAGIC = b'DRIVESYNC-SCAN 1'
+# mtime_ns, path length, length of the NUL-separated subdirectory names
+DIR_RECORD = struct.Struct('<qII')
+WRITE_BATCH = 3 * 4096
+FS_ENCODING = sys.getfilesystemencoding()
+FS_ERRORS = sys.getfilesystemencodeerrors()
+DEFAULT_VERIFY_DIRS = 1000
+EVENT_BUFFER_SIZE = 64 * 1024
+
+if InotifyConstants is not None:
+    WATCH_MASK = (
+        InotifyConstants.IN_CLOSE_WRITE |
+        InotifyConstants.IN_CREATE |
+        InotifyConstants.IN_DELETE |
+        InotifyConstants.IN_MOVED_FROM |
+        InotifyConstants.IN_MOVED_TO |
+        InotifyConstants.IN_DELETE_SELF |
+        InotifyConstants.IN_ONLYDIR |
+        InotifyConstants.IN_DONT_FOLLOW
+    )
+
+
+class DirectoryScanner:
+    """Incremental scanner that only lists directories whose mtime changed"""
+
+    def __init__(self, local_folder, ignore_patterns=None, state_file=None):
+        self.local_folder = local_folder
+        self.ignore_patterns = ignore_patterns or []
+        self.state_file = state_file
+        self.logger = logging.getLogger('drive_sync')
+        # rel_dir -> [mtime_ns, [subdirectory names]]
+        self.dirs = {}
+        self.dirty = False
+
+    def load_state(self):
+        """Load directory mtimes persisted by a previous run"""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        dirs = {}
+        try:
+            with open(self.state_file, 'rb') as f:
+                meta = read_state_header(f, SCAN_STATE_MAGIC)
+                if meta != {'local_folder': self.local_folder}:
+                    return
+                while True:
+                    header = f.read(DIR_RECORD.size)
+                    if not header:
+                        break
+                    if len(header) != DIR_RECORD.size:
+                        raise ValueError("Scan state is truncated")
+                    mtime, path_len, subdirs_len = DIR_RECORD.unpack(header)
+                    rel_dir = read_exact(f, path_len).decode(FS_ENCODING, FS_ERRORS)
+                    subdirs = read_exact(f, subdirs_len).decode(FS_ENCODING, FS_ERRORS)
+                    dirs[rel_dir] = [mtime, subdirs.split('\0') if subdirs else []]
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Error loading scan state, rescanning everything: {str(e)}")
+            return
+        self.dirs = dirs
+
+    def save_state(self):
+        """Persist directory mtimes so the next start can skip unchanged subtrees
+
+        Records are encoded in batches and streamed to the file, so no copy
+        of the whole state is built. The caller holds the scan lock.
+        """
+        if not self.state_file or not self.dirty:
+            return
+        try:
+            with atomic_write(self.state_file) as f:
+                write_state_header(f, SCAN_STATE_MAGIC, {'local_folder': self.local_folder})
+                chunk = []
+                for rel_dir, (mtime, subdirs) in self.dirs.items():
+                    path_bytes = rel_dir.encode(FS_ENCODING, FS_ERRORS)
+                    subdirs_bytes = '\0'.join(subdirs).encode(FS_ENCODING, FS_ERRORS)
+                    chunk.append(DIR_RECORD.pack(mtime, len(path_bytes), len(subdirs_bytes)))
+                    chunk.append(path_bytes)
+                    chunk.append(subdirs_bytes)
+                    if len(chunk) >= WRITE_BATCH:
+                        f.write(b''.join(chunk))
+                        chunk = []
+                f.write(b''.join(chunk))
+            self.dirty = False
+        except Exception as e:
+            self.logger.error(f"Error saving scan state: {str(e)}")
+
+    def abs_path(self, rel_path):
+        """Convert a path relative to the sync folder into an absolute path"""
+        return os.path.join(self.local_folder, rel_path) if rel_path else self.local_folder
+
+    def is_ignored(self, name):
+        return any(name.endswith(pattern) for pattern in self.ignore_patterns)
+
+    def scan(self, file_index, start='', force=(), full=False, recursive=True):
+        """Rescan the subtree at start against file_index
+
+        Directories are only listed when their mtime differs from the stored
+        one, when they are in force, or when full is set. Listing a directory
+        stats each of its files against the index, so it also catches
+        in-place writes. With recursive unset only start itself and any
+        subdirectories that are new are visited. Returns a list of
+        ('sync' | 'delete', rel_path) changes and the list of directories
+        that had to be listed.
+        """
+        changes = []
+        listed_dirs = []
+        stack = [start]
+
+        while stack:
+            rel_dir = stack.pop()
+            entry = self.dirs.get(rel_dir)
+            try:
+                mtime = os.stat(self.abs_path(rel_dir)).st_mtime_ns
+            except OSError:
+                self._drop_subtree(rel_dir, file_index, changes)
+                continue
+
+            if entry is not None and entry[0] == mtime and not full and rel_dir not in force:
+                if recursive:
+                    stack.extend(os.path.join(rel_dir, name) for name in entry[1])
+                continue
+
+            listed_dirs.append(rel_dir)
+            seen = set()
+            subdirs = []
+            try:
+                with os.scandir(self.abs_path(rel_dir)) as it:
+                    for dir_entry in it:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            subdirs.append(dir_entry.name)
+                            continue
+                        if not dir_entry.is_file() or self.is_ignored(dir_entry.name):
+                            continue
+
+                        rel_path = os.path.join(rel_dir, dir_entry.name)
+                        seen.add(rel_path)
+                        stat = dir_entry.stat()
+                        if file_index.stat(rel_path) != (stat.st_size, stat.st_mtime):
+                            changes.append(('sync', rel_path))
+            except OSError:
+                self._drop_subtree(rel_dir, file_index, changes)
+                continue
+
+            for rel_path in set(file_index.iter_dir(rel_dir)) - seen:
+                changes.append(('delete', rel_path))
+            if entry is not None:
+                for name in set(entry[1]) - set(subdirs):
+                    self._drop_subtree(os.path.join(rel_dir, name), file_index, changes)
+
+            self.dirs[rel_dir] = [mtime, subdirs]
+            self.dirty = True
+            if entry is None and rel_dir:
+                # Keep the parent's list complete when a subtree is scanned on its own
+                parent = self.dirs.get(os.path.dirname(rel_dir))
+                name = os.path.basename(rel_dir)
+                if parent is not None and name not in parent[1]:
+                    parent[1].append(name)
+            known_subdirs = set(entry[1]) if entry is not None and not recursive else set()
+            stack.extend(os.path.join(rel_dir, name) for name in subdirs if name not in known_subdirs)
+
+        return changes, listed_dirs
+
+    def _drop_subtree(self, rel_dir, file_index, changes):
+        """Forget a directory that no longer exists and report its files as deleted"""
+        # Follow the stored subdirectory lists so the cost depends on the subtree, not the tree
+        stack = [rel_dir]
+        while stack:
+            dir_path = stack.pop()
+            entry = self.dirs.pop(dir_path, None)
+            if entry is not None:
+                self.dirty = True
+                stack.extend(os.path.join(dir_path, name) for name in entry[1])
+        changes.extend(('delete', rel_path) for rel_path in file_index.iter_dir(rel_dir, recursive=True))
+
+
+class HybridChangeDetector:
+    """Watch hot directories with inotify and rescan the rest incrementally
+
+    Every directory gets an inotify watch while the tree fits in
+    max_watches; beyond that only the most recently active ones do.
+    DirectoryScanner relists any directory whose mtime changed, which
+    catches creates and deletes everywhere. In-place writes don't touch
+    the directory mtime, so each rescan also stats the files of up to
+    verify_dirs directories against the index, cycling through the
+    unwatched ones. The first cycle after start covers every directory to
+    pick up writes made while stopped. A kernel queue overflow forces a
+    relisting of the watched directories instead of losing the dropped
+    events.
+
+    The inotify reader only decodes events and queues the resulting
+    operations and subtree scans; a separate worker thread journals and
+    runs them, so slow uploads never keep the kernel queue from draining.
+    """
+
+    def __init__(self, handler, local_folder, ignore_patterns=None,
+                 max_watches=DEFAULT_MAX_WATCHES, state_file=None, wakeup=None,
+                 verify_dirs=DEFAULT_VERIFY_DIRS):
+        self.handler = handler
+        self.local_folder = local_folder
+        self.scanner = DirectoryScanner(local_folder, ignore_patterns, state_file)
+        self.max_watches = max(1, max_watches)
+        self.verify_dirs = max(1, verify_dirs)
+        self.verify_queue = deque()
+        self.wakeup = wakeup
+        self.logger = logging.getLogger('drive_sync')
+        self.hot_dirs = OrderedDict()  # rel_dir -> watch descriptor
+        self.dir_for_wd = {}
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        self.overflowed = threading.Event()
+        self.work = queue.Queue()  # ('submit', operations) | ('scan', rel_dir), None to stop
+        self.queued_scans = set()
+        self.running = False
+        self.fd = None
+        self.thread = None
+        self.worker = None
+        self.observer = None
+
+    def start(self):
+        """Start watching and catch up on changes made while stopped"""
+        self.scanner.load_state()
+        self.running = True
+
+        if InotifyConstants is not None:
+            fd = inotify_init()
+            if fd >= 0:
+                self.fd = fd
+            else:
+                self.logger.warning(
+                    f"inotify unavailable ({os.strerror(ctypes.get_errno())}), "
+                    "falling back to recursive observer")
+
+        if self.fd is not None:
+            # Watch the directories known from the last run before scanning,
+            # then fill the remaining budget with whatever the scan found
+            self.promote('')
+            self._watch_known_dirs()
+            self.worker = threading.Thread(target=self._apply_work, daemon=True)
+            self.worker.start()
+            self.thread = threading.Thread(target=self._read_events, daemon=True)
+            self.thread.start()
+        else:
+            self.observer = Observer()
+            self.observer.schedule(self.handler, self.local_folder, recursive=True)
+            self.observer.start()
+
+        self._scan_and_apply('')
+        self._watch_known_dirs()
+        # First verification cycle covers every directory, watched or not
+        self.verify_queue = deque(self.scanner.dirs)
+
+    def stop(self):
+        """Stop watching and persist the scan state"""
+        self.running = False
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.worker:
+            # Finish what the reader already queued
+            self.work.put(None)
+            self.worker.join()
+            self.worker = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.save_state()
+
+    def save_state(self):
+        """Persist directory mtimes if they changed since the last save"""
+        with self.scan_lock:
+            self.scanner.save_state()
+
+    def rescan(self, full=False):
+        """Apply changes found by an incremental scan of the whole tree"""
+        force = set()
+        if self.overflowed.is_set():
+            self.overflowed.clear()
+            with self.lock:
+                force = set(self.hot_dirs)
+            self.logger.info(f"Rescanning {len(force)} watched directories after inotify overflow")
+        self._scan_and_apply('', force=force, full=full)
+        self._verify_batch()
+
+    def promote(self, rel_dir, evict=True):
+        """Give a directory an inotify watch, evicting the least recently active one"""
+        if self.fd is None:
+            return
+        with self.lock:
+            if rel_dir in self.hot_dirs:
+                self.hot_dirs.move_to_end(rel_dir)
+                return
+
+            while len(self.hot_dirs) >= self.max_watches:
+                if not evict:
+                    return
+                coldest = next((d for d in self.hot_dirs if d != ''), None)
+                if coldest is None:
+                    return
+                self._unwatch(coldest)
+
+            wd = inotify_add_watch(self.fd, os.fsencode(self.scanner.abs_path(rel_dir)), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    # Kernel watch limit reached: shrink the budget, scans cover the rest
+                    self.max_watches = max(1, len(self.hot_dirs))
+                    self.logger.warning(
+                        f"inotify watch limit reached, limiting hot directories to {self.max_watches}")
+                return
+
+            previous = self.dir_for_wd.get(wd)
+            if previous is not None and previous != rel_dir:
+                # Same inode under a new name (e.g. a renamed directory)
+                self.hot_dirs.pop(previous, None)
+            self.hot_dirs[rel_dir] = wd
+            self.dir_for_wd[wd] = rel_dir
+
+    def _watch_known_dirs(self):
+        """Watch known directories until the budget is used up, without evicting"""
+        for rel_dir in list(self.scanner.dirs):
+            if len(self.hot_dirs) >= self.max_watches:
+                break
+            self.promote(rel_dir, evict=False)
+
+    def _verify_batch(self):
+        """Stat the files of the next few directories against the index"""
+        if not self.verify_queue:
+            # Watched directories report in-place writes themselves
+            with self.lock:
+                cold_dirs = [d for d in self.scanner.dirs if d not in self.hot_dirs]
+            self.verify_queue.extend(cold_dirs)
+
+        batch = []
+        while self.verify_queue and len(batch) < self.verify_dirs:
+            rel_dir = self.verify_queue.popleft()
+            if rel_dir in self.scanner.dirs:
+                batch.append(rel_dir)
+        for rel_dir in batch:
+            self._scan_and_apply(rel_dir, force={rel_dir}, recursive=False)
+
+    def _unwatch(self, rel_dir):
+        wd = self.hot_dirs.pop(rel_dir)
+        self.dir_for_wd.pop(wd, None)
+        inotify_rm_watch(self.fd, wd)
+
+    def _scan_and_apply(self, start, force=(), full=False, recursive=True):
+        with self.scan_lock:
+            changes, listed_dirs = self.scanner.scan(
+                self.handler.file_index, start=start, force=force, full=full, recursive=recursive)
+
+            # Drop watches on directories that were removed or renamed away
+            with self.lock:
+                for rel_dir in [d for d in self.hot_dirs if d and d not in self.scanner.dirs]:
+                    self._unwatch(rel_dir)
+
+            # Directories that changed are the active ones; verification passes
+            # list directories without any change, so they don't count
+            if recursive:
+                for rel_dir in listed_dirs:
+                    self.promote(rel_dir)
+
+        # Uploads run outside scan_lock so the inotify reader isn't held up by them
+        if changes:
+            self.logger.info(f"Incremental scan found {len(changes)} local changes")
+            self.handler.submit([
+                (action, self.scanner.abs_path(rel_path)) for action, rel_path in changes
+            ])
+
+    def _read_events(self):
+        while self.running:
+            try:
+                ready, _, _ = select.select([self.fd], [], [], 1.0)
+                if not ready:
+                    continue
+                buffer = os.read(self.fd, EVENT_BUFFER_SIZE)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if self.running:
+                    self.logger.error(f"Error reading inotify events: {str(e)}")
+                break
+
+            # Everything from one read is journaled and committed as a single batch
+            operations = []
+            offset = 0
+            while offset + 16 <= len(buffer):
+                wd, mask, _, length = struct.unpack_from('iIII', buffer, offset)
+                name = buffer[offset + 16:offset + 16 + length].rstrip(b'\0')
+                offset += 16 + length
+                try:
+                    self._dispatch(wd, mask, os.fsdecode(name), operations)
+                except Exception as e:
+                    self.logger.error(f"Error handling inotify event: {str(e)}")
+            if operations:
+                self.work.put(('submit', operations))
+
+    def _apply_work(self):
+        """Run operations and scans queued by the reader, in order"""
+        while True:
+            item = self.work.get()
+            if item is None:
+                return
+            kind, arg = item
+            try:
+                if kind == 'scan':
+                    with self.lock:
+                        self.queued_scans.discard(arg)
+                    self._scan_and_apply(arg)
+                else:
+                    self.handler.submit(arg)
+            except Exception as e:
+                self.logger.error(f"Error applying local changes: {str(e)}")
+
+    def _dispatch(self, wd, mask, name, operations):
+        if mask & InotifyConstants.IN_Q_OVERFLOW:
+            self.logger.warning("inotify event queue overflowed, scheduling a targeted rescan")
+            self.overflowed.set()
+            if self.wakeup:
+                self.wakeup()
+            return
+
+        with self.lock:
+            rel_dir = self.dir_for_wd.get(wd)
+            if rel_dir is not None and mask & InotifyConstants.IN_IGNORED:
+                self.dir_for_wd.pop(wd, None)
+                if self.hot_dirs.get(rel_dir) == wd:
+                    del self.hot_dirs[rel_dir]
+        if rel_dir is None or not name:
+            return
+
+        rel_path = os.path.join(rel_dir, name)
+        if mask & InotifyConstants.IN_ISDIR:
+            # New, removed or renamed subtree: scan just that part of the tree,
+            # after the file operations queued so far
+            if operations:
+                self.work.put(('submit', operations[:]))
+                operations.clear()
+            with self.lock:
+                if rel_path in self.queued_scans:
+                    return
+                self.queued_scans.add(rel_path)
+            self.work.put(('scan', rel_path))
+            return
+        if self.scanner.is_ignored(name):
+            return
+
+        local_path = self.scanner.abs_path(rel_path)
+        if mask & (InotifyConstants.IN_CLOSE_WRITE | InotifyConstants.IN_MOVED_TO):
+            operations.append(('sync', local_path))
+        elif mask & (InotifyConstants.IN_DELETE | InotifyConstants.IN_MOVED_FROM):
+            operations.append(('delete', local_path))
@@ -1,10 +1,23 @@
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from google_auth_httplib2 import AuthorizedHttp
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
 import os
 import logging
+import threading
+
+PARALLEL_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
 
 class DriveAPI:
     def __init__(self, creds):
+        self.creds = creds
+        self.local = threading.local()
+        self.download_pool = None
+        self.download_pool_size = 0
+        self.download_pool_lock = threading.Lock()
         self.service = build('drive', 'v3', credentials=creds)
         self.logger = logging.getLogger('drive_sync')
     
@@ -20,6 +33,19 @@ class DriveAPI:
             self.logger.error(f"Error getting folder ID: {str(e)}")
             return None
     
+    def folder_exists(self, folder_id):
+        """Check that a folder ID still refers to a folder that is not trashed"""
+        try:
+            folder = self.service.files().get(
+                fileId=folder_id,
+                fields='id, mimeType, trashed'
+            ).execute()
+            return (folder.get('mimeType') == 'application/vnd.google-apps.folder'
+                    and not folder.get('trashed'))
+        except Exception as e:
+            self.logger.warning(f"Cached folder ID is no longer valid: {str(e)}")
+            return False
+    
     def create_folder(self, folder_name, parent_id=None):
         """Create a new folder in Google Drive"""
         try:
@@ -77,26 +103,90 @@ class DriveAPI:
             return False
     
     def list_files(self, folder_id):
-        """List all files in a folder"""
+        """List all files in a folder, or None if the listing failed"""
         try:
             response = self.service.files().list(
                 q=f"'{folder_id}' in parents",
-                fields="files(id, name, modifiedTime, size)"
+                fields="files(id, name, modifiedTime, size, md5Checksum)"
             ).execute()
             return response.get('files', [])
         except Exception as e:
+            # Not [], which would look like every remote file was deleted
             self.logger.error(f"Error listing files: {str(e)}")
-            return []
+            return None
     
     def get_file_id(self, folder_id, file_name):
-        """Get the ID of a file by name in a specific folder"""
+        """Get the ID of a file by name in a specific folder, or None if there is none
+        
+        API errors are raised rather than returned as None, so a failed lookup
+        isn't mistaken for a missing file.
+        """
+        response = self.service.files().list(
+            q=f"name='{file_name}' and '{folder_id}' in parents",
+            fields="files(id)"
+        ).execute()
+        files = response.get('files', [])
+        return files[0]['id'] if files else None
+    
+    def download_file(self, file_id, local_path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Stream a file from Google Drive to local_path over a single connection"""
         try:
-            response = self.service.files().list(
-                q=f"name='{file_name}' and '{folder_id}' in parents",
-                fields="files(id)"
-            ).execute()
-            files = response.get('files', [])
-            return files[0]['id'] if files else None
+            request = self.service.files().get_media(fileId=file_id)
+            with open(local_path, 'wb') as local_file:
+                downloader = MediaIoBaseDownload(local_file, request, chunksize=chunk_size)
+                done = False
+                while not done:
+                    _, done = downloader.next_chunk()
+            return True
         except Exception as e:
-            self.logger.error(f"Error getting file ID: {str(e)}")
-            return None
\ No newline at end of file
+            self.logger.error(f"Error downloading file: {str(e)}")
+            return False
+    
+    def download_file_ranges(self, file_id, local_path, size,
+                             connections=DOWNLOAD_CONNECTIONS, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Download a file as byte ranges fetched over several connections at once
+        
+        local_path is preallocated to size and every range is written at its
+        own offset, so ranges can complete in any order.
+        """
+        try:
+            with open(local_path, 'wb') as local_file:
+                local_file.truncate(size)
+            
+            ranges = [(start, min(start + chunk_size, size) - 1)
+                      for start in range(0, size, chunk_size)]
+            pool = self._download_pool(connections)
+            # list() re-raises the first failed range
+            list(pool.map(lambda byte_range: self._download_range(file_id, local_path, *byte_range), ranges))
+            return True
+        except Exception as e:
+            self.logger.error(f"Error downloading file ranges: {str(e)}")
+            return False
+    
+    def _download_range(self, file_id, local_path, start, end):
+        request = self.service.files().get_media(fileId=file_id)
+        request.headers['range'] = f'bytes={start}-{end}'
+        content = request.execute(http=self._thread_http())
+        if len(content) != end - start + 1:
+            raise IOError(f"Short read for bytes {start}-{end}: got {len(content)} bytes")
+        
+        with open(local_path, 'r+b') as local_file:
+            local_file.seek(start)
+            local_file.write(content)
+    
+    def _download_pool(self, connections):
+        """Range download threads live as long as the API object, so their connections are reused across files"""
+        with self.download_pool_lock:
+            if self.download_pool is None or self.download_pool_size < connections:
+                if self.download_pool:
+                    self.download_pool.shutdown(wait=False)
+                self.download_pool = ThreadPoolExecutor(
+                    max_workers=connections, thread_name_prefix='drive-download')
+                self.download_pool_size = connections
+            return self.download_pool
+    
+    def _thread_http(self):
+        """httplib2 is not thread-safe, so each download thread gets its own connection"""
+        if not hasattr(self.local, 'http'):
+            self.local.http = AuthorizedHttp(self.creds, http=httplib2.Http())
+        return self.local.http
@@ -0,0 +1,225 @@
+from array import array
+import os
+import struct
+import sys
+import threading
+from .utils import read_exact
+
+DIGEST_SIZE = 16
+DIR_HEADER = struct.Struct('<III')
+
+class FileRecord:
+    """Metadata of one indexed file, created on demand from the index columns"""
+    __slots__ = ('path', 'size', 'modified', 'digest')
+
+    def __init__(self, path, size, modified, digest):
+        self.path = path
+        self.size = size
+        self.modified = modified
+        self.digest = digest
+
+class DirNode:
+    """One directory in the index trie"""
+    __slots__ = ('path', 'name', 'parent', 'children', 'files')
+
+    def __init__(self, path, name, parent):
+        self.path = path
+        self.name = name
+        self.parent = parent
+        self.children = {}  # name -> DirNode
+        self.files = {}  # name -> row in the column arrays
+
+class FileIndex:
+    """Compact index of local files keyed by path relative to the sync folder
+
+    Paths are stored as a trie of directories, each holding its file
+    names, rather than as full strings, and per-file metadata lives in
+    array-backed columns (sizes, mtimes and raw 16-byte MD5 digests)
+    addressed by row number. A flat map from directory path to trie node
+    makes lookups two dict probes regardless of depth; the trie itself is
+    only walked to list a subtree. All methods are thread-safe; iteration
+    works on a snapshot.
+    """
+
+    def __init__(self):
+        self.root = DirNode('', '', None)
+        self.dirs = {'': self.root}  # rel_dir -> DirNode
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.digests = bytearray()
+        self.free_rows = []
+        self.count = 0
+        self.version = 0  # bumped on every change, so callers can tell when to save
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, rel_path):
+        return self.get(rel_path) is not None
+
+    def __iter__(self):
+        return iter(self.iter_dir('', recursive=True))
+
+    def get(self, rel_path):
+        """Return the FileRecord for rel_path, or None if it isn't indexed"""
+        rel_dir, _, name = rel_path.rpartition(os.sep)
+        with self.lock:
+            node = self.dirs.get(rel_dir)
+            row = node.files.get(name) if node else None
+            if row is None:
+                return None
+            return FileRecord(
+                rel_path,
+                self.sizes[row],
+                self.mtimes[row],
+                bytes(self.digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE])
+            )
+
+    def stat(self, rel_path):
+        """Return (size, modified) for rel_path, or None; cheaper than get() for change checks"""
+        rel_dir, _, name = rel_path.rpartition(os.sep)
+        with self.lock:
+            node = self.dirs.get(rel_dir)
+            row = node.files.get(name) if node else None
+            if row is None:
+                return None
+            return self.sizes[row], self.mtimes[row]
+
+    def set(self, rel_path, size, modified, file_hash):
+        """Add or update a file; file_hash is a hex MD5 digest or its raw bytes"""
+        digest = bytes.fromhex(file_hash) if isinstance(file_hash, str) else file_hash
+        rel_dir, _, name = rel_path.rpartition(os.sep)
+        with self.lock:
+            node = self.dirs.get(rel_dir)
+            if node is None:
+                node = self._make_dir(rel_dir)
+
+            row = node.files.get(name)
+            if row is None:
+                row = self._allocate_row()
+                node.files[name] = row
+                self.count += 1
+            self.sizes[row] = size
+            self.mtimes[row] = modified
+            self.digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE] = digest
+            self.version += 1
+
+    def remove(self, rel_path):
+        """Remove a file from the index, returning whether it was indexed"""
+        rel_dir, _, name = rel_path.rpartition(os.sep)
+        with self.lock:
+            node = self.dirs.get(rel_dir)
+            row = node.files.pop(name, None) if node else None
+            if row is None:
+                return False
+            self.free_rows.append(row)
+            self.count -= 1
+            self.version += 1
+
+            # Prune directories left empty
+            while node.parent is not None and not node.files and not node.children:
+                del node.parent.children[node.name]
+                del self.dirs[node.path]
+                node = node.parent
+            return True
+
+    def iter_dir(self, rel_dir='', recursive=False):
+        """List indexed paths in a directory, optionally including subdirectories"""
+        with self.lock:
+            node = self.dirs.get(rel_dir)
+            if node is None:
+                return []
+            paths = []
+            stack = [(node, rel_dir)]
+            while stack:
+                node, prefix = stack.pop()
+                paths.extend(os.path.join(prefix, name) for name in node.files)
+                if recursive:
+                    stack.extend((child, os.path.join(prefix, name))
+                                 for name, child in node.children.items())
+            return paths
+
+    def dump(self, f):
+        """Write the index to a binary file, one directory at a time
+
+        Each directory is a DIR_HEADER (path length, names length, file
+        count) followed by its path, its NUL-separated file names and the
+        file's sizes, mtimes and digests as little-endian columns. The lock
+        is only held while one directory is copied out, and memory use
+        stays proportional to the largest directory.
+        """
+        with self.lock:
+            dirs = list(self.dirs.items())
+        for rel_dir, node in dirs:
+            with self.lock:
+                if self.dirs.get(rel_dir) is not node or not node.files:
+                    continue
+                names = list(node.files)
+                rows = list(node.files.values())
+                sizes = array('q', [self.sizes[row] for row in rows])
+                mtimes = array('d', [self.mtimes[row] for row in rows])
+                digests = b''.join(
+                    self.digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE] for row in rows)
+
+            if sys.byteorder == 'big':
+                sizes.byteswap()
+                mtimes.byteswap()
+            path_bytes = os.fsencode(rel_dir)
+            names_bytes = b'\0'.join(os.fsencode(name) for name in names)
+            f.write(DIR_HEADER.pack(len(path_bytes), len(names_bytes), len(names)))
+            f.write(path_bytes)
+            f.write(names_bytes)
+            f.write(sizes.tobytes())
+            f.write(mtimes.tobytes())
+            f.write(digests)
+
+    @classmethod
+    def load(cls, f):
+        """Read an index written by dump; raises ValueError if the data is truncated"""
+        index = cls()
+        while True:
+            header = f.read(DIR_HEADER.size)
+            if not header:
+                break
+            if len(header) != DIR_HEADER.size:
+                raise ValueError("File index is truncated")
+            path_len, names_len, count = DIR_HEADER.unpack(header)
+            rel_dir = os.fsdecode(read_exact(f, path_len))
+            names = [os.fsdecode(name) for name in read_exact(f, names_len).split(b'\0')]
+            sizes = array('q', read_exact(f, 8 * count))
+            mtimes = array('d', read_exact(f, 8 * count))
+            digests = read_exact(f, DIGEST_SIZE * count)
+            if len(names) != count:
+                raise ValueError("File index is corrupt")
+            if sys.byteorder == 'big':
+                sizes.byteswap()
+                mtimes.byteswap()
+
+            node = index.dirs.get(rel_dir) or index._make_dir(rel_dir)
+            first_row = len(index.sizes)
+            index.sizes.extend(sizes)
+            index.mtimes.extend(mtimes)
+            index.digests.extend(digests)
+            node.files.update(zip(names, range(first_row, first_row + count)))
+            index.count += count
+        return index
+
+    def _allocate_row(self):
+        if self.free_rows:
+            return self.free_rows.pop()
+        self.sizes.append(0)
+        self.mtimes.append(0.0)
+        self.digests.extend(bytes(DIGEST_SIZE))
+        return len(self.sizes) - 1
+
+    def _make_dir(self, rel_dir):
+        """Create the trie node for rel_dir and any missing parents"""
+        parent_dir, _, name = rel_dir.rpartition(os.sep)
+        parent = self.dirs.get(parent_dir)
+        if parent is None:
+            parent = self._make_dir(parent_dir)
+        # Directory names repeat across the tree, so share one string each
+        name = sys.intern(name)
+        node = parent.children[name] = self.dirs[rel_dir] = DirNode(rel_dir, name, parent)
+        return node
@@ -0,0 +1,131 @@
+from multiprocessing.connection import Client, AuthenticationError
+import os
+import sys
+import time
+import secrets
+import tempfile
+import subprocess
+
+KEY_FILE = os.path.join(os.path.dirname(__file__), '..', 'engine.key')
+LOCK_FILE = os.path.join(os.path.dirname(__file__), '..', 'engine.lock')
+DAEMON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sync_daemon.py')
+
+if sys.platform == 'win32':
+    import msvcrt
+    IPC_FAMILY = 'AF_PIPE'
+    IPC_ADDRESS = r'\\.\pipe\drive_sync_engine'
+else:
+    import fcntl
+    IPC_FAMILY = 'AF_UNIX'
+    IPC_ADDRESS = os.path.join(tempfile.gettempdir(), f'drive_sync_engine-{os.getuid()}.sock')
+
+class EngineUnavailable(Exception):
+    """Raised when no engine worker is listening on the IPC channel"""
+
+def load_authkey(create=False):
+    """Read the shared secret that authenticates IPC clients, optionally creating it"""
+    try:
+        with open(KEY_FILE, 'rb') as f:
+            return f.read()
+    except OSError:
+        if not create:
+            return None
+
+    authkey = secrets.token_bytes(32)
+    fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+    return authkey
+
+def acquire_worker_lock():
+    """Take the exclusive lock held by the engine worker for its whole lifetime
+
+    Returns the open lock file, to be closed on exit, or None if another
+    worker holds it. The operating system drops the lock if the worker dies.
+    """
+    lock_file = open(LOCK_FILE, 'a+')
+    try:
+        if sys.platform == 'win32':
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+class EngineClient:
+    """Control the sync engine worker process over the local IPC channel
+
+    Every request opens its own connection, so one client can be shared
+    by all threads of a multi-threaded WSGI server.
+    """
+
+    def __init__(self, address=IPC_ADDRESS, timeout=5):
+        self.address = address
+        self.timeout = timeout
+
+    def request(self, command, **args):
+        """Send a command to the worker and return its reply"""
+        authkey = load_authkey()
+        if authkey is None:
+            raise EngineUnavailable("Sync engine is not running")
+
+        try:
+            conn = Client(self.address, family=IPC_FAMILY, authkey=authkey)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise EngineUnavailable(f"Sync engine is not running: {str(e)}")
+
+        with conn:
+            try:
+                conn.send(dict(args, command=command))
+                if not conn.poll(self.timeout):
+                    raise EngineUnavailable(f"Sync engine did not answer '{command}'")
+                reply = conn.recv()
+            except (OSError, EOFError) as e:
+                raise EngineUnavailable(f"Lost connection to sync engine: {str(e)}")
+
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def is_running(self):
+        try:
+            self.request('ping')
+            return True
+        except (EngineUnavailable, RuntimeError):
+            return False
+
+    def status(self):
+        return self.request('status')
+
+    def sync_now(self):
+        return self.request('sync_now')
+
+    def stop(self):
+        return self.request('stop')
+
+    def events(self, since=0, boot_id=None):
+        """Return the worker's boot_id and its events newer than since
+        
+        since only counts when boot_id matches the running worker; events
+        from a different worker are returned from the start.
+        """
+        return self.request('events', since=since, boot_id=boot_id)
+
+def spawn_worker(timeout=15):
+    """Start sync_daemon.py --headless as the engine worker unless one is already running"""
+    client = EngineClient()
+    if client.is_running():
+        return True
+
+    kwargs = {'start_new_session': True} if sys.platform != 'win32' else {}
+    subprocess.Popen([sys.executable, DAEMON_SCRIPT, '--headless'], cwd=os.getcwd(), **kwargs)
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if client.is_running():
+            return True
+        time.sleep(0.2)
+    return False
@@ -0,0 +1,212 @@
+import os
+import json
+import logging
+import threading
+
+DEFAULT_COMPACT_THRESHOLD = 10000
+WRITE_RETRY_DELAY = 5
+
+
+class OperationJournal:
+    """Durable write-ahead log of sync operations
+
+    Each operation is appended as a JSON line before it runs and a done
+    marker is appended after it finishes. Appends are buffered and a
+    background writer flushes and fsyncs whatever has accumulated in one
+    go (group commit), so callers only block in wait() and many
+    operations share a single fsync. The file is rewritten with just the
+    unfinished entries on open and whenever it grows past
+    compact_threshold lines, most of them finished.
+
+    The first line records local_folder, and a journal written for a
+    different folder is discarded on open. A failed write is truncated
+    away and retried, and wait() reports the records as not durable
+    until the retry succeeds.
+    """
+
+    def __init__(self, journal_file, local_folder=None, compact_threshold=DEFAULT_COMPACT_THRESHOLD):
+        self.journal_file = journal_file
+        self.local_folder = local_folder
+        self.compact_threshold = compact_threshold
+        self.logger = logging.getLogger('drive_sync')
+        self.cond = threading.Condition()
+        self.buffer = []
+        self.pending = {}  # seq -> entry
+        self.latest_for_path = {}  # path -> seq of its newest unfinished entry
+        self.next_seq = 1
+        self.durable_seq = 0
+        self.lines_written = 0
+        self.write_error = None
+        self.good_offset = 0  # end of the last fully written batch
+        self.file = None
+        self.thread = None
+        self.running = False
+
+    def open(self):
+        """Open the journal and return unfinished entries from a previous run"""
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash; everything before it is intact
+                        break
+                    if 'local_folder' in record:
+                        if record['local_folder'] != self.local_folder:
+                            self.logger.warning(
+                                f"Ignoring operation journal written for {record['local_folder']}")
+                            break
+                    elif 'done' in record:
+                        self._finish(record['done'])
+                    else:
+                        self._add(record)
+                        self.next_seq = max(self.next_seq, record['seq'] + 1)
+
+        self.durable_seq = self.next_seq - 1
+        self._compact()
+        self.running = True
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+        return [self.pending[seq] for seq in sorted(self.pending)]
+
+    def append(self, op, path, **extra):
+        """Queue an operation for the journal and return its sequence number"""
+        with self.cond:
+            seq = self.next_seq
+            self.next_seq += 1
+            entry = dict(extra, seq=seq, op=op, path=path)
+            self._add(entry)
+            self.buffer.append(entry)
+            self.cond.notify_all()
+            return seq
+
+    def mark_done(self, seq):
+        """Record that an operation finished; does not wait for the disk"""
+        with self.cond:
+            if self._finish(seq):
+                self.buffer.append({'done': seq})
+                self.cond.notify_all()
+
+    def wait(self, seq):
+        """Block until the operation with this sequence number is on disk
+
+        Returns False without waiting further if the journal can't be
+        written, or if it was closed first.
+        """
+        with self.cond:
+            while self.durable_seq < seq:
+                if self.write_error or not self.running:
+                    return False
+                self.cond.wait()
+            return True
+
+    def close(self):
+        """Flush outstanding records and stop the writer"""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.file:
+            try:
+                self._flush(self.buffer)
+            except Exception as e:
+                self.logger.error(f"Error writing operation journal: {str(e)}")
+                self._truncate()
+            self.buffer = []
+            self.file.close()
+            self.file = None
+
+    def _add(self, entry):
+        """Track an unfinished entry; only the newest one per path is kept"""
+        previous = self.latest_for_path.get(entry['path'])
+        if previous is not None:
+            # A newer operation on the same path supersedes the older one
+            self.pending.pop(previous, None)
+        self.pending[entry['seq']] = entry
+        self.latest_for_path[entry['path']] = entry['seq']
+
+    def _finish(self, seq):
+        entry = self.pending.pop(seq, None)
+        if entry is None:
+            return False
+        if self.latest_for_path.get(entry['path']) == seq:
+            del self.latest_for_path[entry['path']]
+        return True
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while not self.buffer and self.running:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                batch = self.buffer
+                self.buffer = []
+                last_seq = self.next_seq - 1
+
+            try:
+                self._flush(batch)
+            except Exception as e:
+                self.logger.error(f"Error writing operation journal: {str(e)}")
+                self._truncate()
+                with self.cond:
+                    # Nothing in the batch is durable: requeue it and retry after a pause
+                    self.buffer = batch + self.buffer
+                    self.write_error = e
+                    self.cond.notify_all()
+                    self.cond.wait(WRITE_RETRY_DELAY)
+                continue
+
+            with self.cond:
+                self.write_error = None
+                self.durable_seq = max(self.durable_seq, last_seq)
+                if self.lines_written >= max(self.compact_threshold, 2 * len(self.pending)):
+                    try:
+                        self._compact()
+                    except Exception as e:
+                        self.logger.error(f"Error compacting operation journal: {str(e)}")
+                self.cond.notify_all()
+
+    def _flush(self, records):
+        if not records:
+            return
+        self.file.write(''.join(json.dumps(record) + '\n' for record in records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.lines_written += len(records)
+        self.good_offset = self.file.tell()
+
+    def _truncate(self):
+        """Cut a partly written batch off the journal so later records stay readable"""
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self.journal_file, self.good_offset)
+        except OSError as e:
+            self.logger.error(f"Error truncating operation journal: {str(e)}")
+        self.file = open(self.journal_file, 'a')
+
+    def _compact(self):
+        """Rewrite the journal with only unfinished entries; caller holds the lock"""
+        if self.file:
+            self.file.close()
+        tmp_file = self.journal_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps({'local_folder': self.local_folder}) + '\n')
+            for seq in sorted(self.pending):
+                f.write(json.dumps(self.pending[seq]) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+
+        # Everything still buffered is either in the rewritten file or done
+        self.buffer = []
+        self.durable_seq = self.next_seq - 1
+        self.lines_written = len(self.pending)
+        self.file = open(self.journal_file, 'a')
+        self.good_offset = self.file.tell()
@@ -2,25 +2,86 @@ import os
 import time
 import logging
 import hashlib
-from watchdog.observers import Observer
+import threading
 from watchdog.events import FileSystemEventHandler
 from .auth import authenticate
-from .drive_api import DriveAPI
-from .utils import ensure_dir, get_file_hash
+from .drive_api import (
+    DriveAPI, PARALLEL_DOWNLOAD_THRESHOLD, DOWNLOAD_CONNECTIONS, DOWNLOAD_CHUNK_SIZE
+)
+from .change_detector import HybridChangeDetector, DEFAULT_MAX_WATCHES, DEFAULT_VERIFY_DIRS
+from .journal import OperationJournal
+from .file_index import FileIndex
+from .utils import (
+    ensure_dir, get_file_hash, load_json, save_json,
+    atomic_write, write_state_header, read_state_header
+)
+
+# Suffix of in-progress downloads; always ignored so they are never uploaded
+PARTIAL_SUFFIX = '.drivesync-part'
+INDEX_STATE_MAGIC = b'DRIVESYNC-INDEX 1'
 
 class SyncHandler(FileSystemEventHandler):
-    def __init__(self, drive_api, local_folder, drive_folder_id, ignore_patterns=None):
+    def __init__(self, drive_api, local_folder, drive_folder_id, ignore_patterns=None, journal=None,
+                 download_threshold=PARALLEL_DOWNLOAD_THRESHOLD,
+                 download_connections=DOWNLOAD_CONNECTIONS,
+                 download_chunk_size=DOWNLOAD_CHUNK_SIZE,
+                 index_file=None):
         self.drive_api = drive_api
         self.local_folder = local_folder
         self.drive_folder_id = drive_folder_id
         self.ignore_patterns = ignore_patterns or []
+        self.journal = journal
+        self.download_threshold = download_threshold
+        self.download_connections = download_connections
+        self.download_chunk_size = download_chunk_size
+        self.index_file = index_file
+        self.saved_index_version = None
+        # local_path -> (journal seq, operation) of operations that failed and will be retried
+        self.failed = {}
+        self.failed_lock = threading.Lock()
         self.logger = logging.getLogger('drive_sync')
-        self.file_index = self.build_file_index()
+        self.file_index = self.load_file_index()
         self.last_sync_time = time.time()
     
+    def load_file_index(self):
+        """Load the index saved by the previous run, building a new one if there is none
+        
+        Starting from the saved index lets the first scan find what changed
+        while the engine was stopped.
+        """
+        if self.index_file and os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'rb') as f:
+                    meta = read_state_header(f, INDEX_STATE_MAGIC)
+                    if meta == {'local_folder': self.local_folder, 'ignore_patterns': self.ignore_patterns}:
+                        index = FileIndex.load(f)
+                        self.saved_index_version = index.version
+                        return index
+            except (OSError, ValueError) as e:
+                self.logger.error(f"Error loading file index, rebuilding it: {str(e)}")
+        return self.build_file_index()
+    
+    def save_file_index(self):
+        """Persist the file index if it changed since the last save"""
+        if not self.index_file:
+            return
+        version = self.file_index.version
+        if version == self.saved_index_version:
+            return
+        try:
+            with atomic_write(self.index_file) as f:
+                write_state_header(f, INDEX_STATE_MAGIC, {
+                    'local_folder': self.local_folder,
+                    'ignore_patterns': self.ignore_patterns
+                })
+                self.file_index.dump(f)
+            self.saved_index_version = version
+        except Exception as e:
+            self.logger.error(f"Error saving file index: {str(e)}")
+    
     def build_file_index(self):
         """Create index of local files with metadata"""
-        index = {}
+        index = FileIndex()
         for root, _, files in os.walk(self.local_folder):
             for file in files:
                 if any(file.endswith(pattern) for pattern in self.ignore_patterns):
@@ -28,90 +89,166 @@ class SyncHandler(FileSystemEventHandler):
                     
                 path = os.path.join(root, file)
                 rel_path = os.path.relpath(path, self.local_folder)
-                index[rel_path] = {
-                    'path': path,
-                    'size': os.path.getsize(path),
-                    'modified': os.path.getmtime(path),
-                    'hash': get_file_hash(path)
-                }
+                index.set(
+                    rel_path,
+                    os.path.getsize(path),
+                    os.path.getmtime(path),
+                    get_file_hash(path)
+                )
         return index
     
     def on_modified(self, event):
         if not event.is_directory:
-            self.sync_to_drive(event.src_path)
+            self.submit([('sync', event.src_path)])
     
     def on_created(self, event):
         if not event.is_directory:
-            self.sync_to_drive(event.src_path)
+            self.submit([('sync', event.src_path)])
     
     def on_deleted(self, event):
         if not event.is_directory:
-            self.delete_from_drive(event.src_path)
+            self.submit([('delete', event.src_path)])
+    
+    def submit(self, operations):
+        """Journal a batch of (action, local_path[, drive_file]) operations, then run them in order"""
+        if not operations:
+            return
+        
+        seqs = []
+        if self.journal:
+            for operation in operations:
+                action, local_path = operation[0], operation[1]
+                extra = {'file': operation[2]} if len(operation) > 2 else {}
+                rel_path = os.path.relpath(local_path, self.local_folder)
+                seqs.append(self.journal.append(action, rel_path, **extra))
+            # One group commit covers the whole batch
+            if not self.journal.wait(seqs[-1]):
+                self.logger.warning("Operation journal not on disk, running operations without crash protection")
+        
+        with self.failed_lock:
+            # A newer operation on a path supersedes one waiting for a retry
+            for operation in operations:
+                self.failed.pop(operation[1], None)
+        
+        for i, operation in enumerate(operations):
+            self.finish_operation(seqs[i] if seqs else None, operation)
+    
+    def replay(self, entries):
+        """Run journal entries left unfinished by a previous run"""
+        if entries:
+            self.logger.info(f"Replaying {len(entries)} unfinished operations from the journal")
+        for entry in entries:
+            local_path = os.path.join(self.local_folder, entry['path'])
+            operation = (entry['op'], local_path, entry['file']) if 'file' in entry else (entry['op'], local_path)
+            self.finish_operation(entry['seq'], operation)
+    
+    def retry_failed(self):
+        """Run failed operations again; they stay journaled until they succeed"""
+        with self.failed_lock:
+            failed = list(self.failed.items())
+        if failed:
+            self.logger.info(f"Retrying {len(failed)} failed operations")
+        for local_path, (seq, operation) in failed:
+            if self.run_operation(*operation):
+                with self.failed_lock:
+                    # Unless a newer operation on the path replaced it meanwhile
+                    if self.failed.get(local_path) == (seq, operation):
+                        del self.failed[local_path]
+                if self.journal and seq is not None:
+                    self.journal.mark_done(seq)
+    
+    def finish_operation(self, seq, operation):
+        """Run an operation, then mark it done in the journal or keep it for a retry"""
+        if self.run_operation(*operation):
+            if self.journal and seq is not None:
+                self.journal.mark_done(seq)
+        else:
+            with self.failed_lock:
+                self.failed[operation[1]] = (seq, operation)
+    
+    def run_operation(self, action, local_path, drive_file=None):
+        """Run a single sync operation, returning whether it succeeded"""
+        if action == 'sync':
+            # The file may have gone away since the operation was queued
+            if os.path.isfile(local_path):
+                return self.sync_to_drive(local_path)
+            return True
+        if action == 'delete':
+            return self.delete_from_drive(local_path)
+        if action == 'download':
+            return self.download_from_drive(drive_file, local_path)
+        self.logger.error(f"Unknown sync operation: {action}")
+        return True
     
     def sync_to_drive(self, local_path):
-        """Sync a local file to Google Drive"""
+        """Sync a local file to Google Drive, returning whether it succeeded"""
         try:
             rel_path = os.path.relpath(local_path, self.local_folder)
             file_name = os.path.basename(local_path)
             
             # Skip files that match ignore patterns
             if any(file_name.endswith(pattern) for pattern in self.ignore_patterns):
-                return
+                return True
                 
             # Check if file exists in Drive
             file_id = self.drive_api.get_file_id(self.drive_folder_id, file_name)
             
             if file_id:
                 # Update existing file
-                self.drive_api.update_file(file_id, local_path)
+                if not self.drive_api.update_file(file_id, local_path):
+                    return False
                 self.logger.info(f"Updated file in Drive: {rel_path}")
             else:
                 # Upload new file
-                self.drive_api.upload_file(local_path, self.drive_folder_id)
+                if not self.drive_api.upload_file(local_path, self.drive_folder_id):
+                    return False
                 self.logger.info(f"Uploaded new file to Drive: {rel_path}")
                 
             # Update file index
-            if rel_path in self.file_index:
-                self.file_index[rel_path]['modified'] = os.path.getmtime(local_path)
-                self.file_index[rel_path]['hash'] = get_file_hash(local_path)
-            else:
-                self.file_index[rel_path] = {
-                    'path': local_path,
-                    'size': os.path.getsize(local_path),
-                    'modified': os.path.getmtime(local_path),
-                    'hash': get_file_hash(local_path)
-                }
+            self.file_index.set(
+                rel_path,
+                os.path.getsize(local_path),
+                os.path.getmtime(local_path),
+                get_file_hash(local_path)
+            )
+            return True
                 
         except Exception as e:
             self.logger.error(f"Error syncing to Drive: {str(e)}")
+            return False
     
     def delete_from_drive(self, local_path):
-        """Delete a file from Google Drive"""
+        """Delete a file from Google Drive, returning whether it succeeded"""
         try:
             rel_path = os.path.relpath(local_path, self.local_folder)
             file_name = os.path.basename(local_path)
             
             # Skip files that match ignore patterns
             if any(file_name.endswith(pattern) for pattern in self.ignore_patterns):
-                return
+                return True
                 
             # Find corresponding Drive file and delete
             file_id = self.drive_api.get_file_id(self.drive_folder_id, file_name)
             if file_id:
-                self.drive_api.delete_file(file_id)
+                if not self.drive_api.delete_file(file_id):
+                    return False
                 self.logger.info(f"Deleted file from Drive: {rel_path}")
                 
             # Remove from file index
-            if rel_path in self.file_index:
-                del self.file_index[rel_path]
+            self.file_index.remove(rel_path)
+            return True
                 
         except Exception as e:
             self.logger.error(f"Error deleting from Drive: {str(e)}")
+            return False
     
     def poll_drive_changes(self):
         """Poll for changes in Google Drive and sync locally"""
         try:
             drive_files = self.drive_api.list_files(self.drive_folder_id)
+            if drive_files is None:
+                return
+            downloads = []
             
             for drive_file in drive_files:
                 file_name = drive_file['name']
@@ -131,10 +268,12 @@ class SyncHandler(FileSystemEventHandler):
                     
                     # If Drive file is newer, download it
                     if drive_modified > local_modified and drive_modified > self.last_sync_time:
-                        self.download_from_drive(drive_file, local_path)
+                        downloads.append(('download', local_path, drive_file))
                 else:
                     # File doesn't exist locally, download it
-                    self.download_from_drive(drive_file, local_path)
+                    downloads.append(('download', local_path, drive_file))
+            
+            self.submit(downloads)
             
             # Check for deleted files in Drive
             local_files = set(os.listdir(self.local_folder))
@@ -155,38 +294,79 @@ class SyncHandler(FileSystemEventHandler):
             self.logger.error(f"Error polling Drive changes: {str(e)}")
     
     def download_from_drive(self, drive_file, local_path):
-        """Download a file from Google Drive"""
+        """Download a file from Google Drive, returning whether it succeeded"""
         try:
             file_id = drive_file['id']
-            request = self.drive_api.service.files().get_media(fileId=file_id)
+            size = int(drive_file.get('size', 0))
             
+            # Download next to the target so the final rename is atomic
             ensure_dir(os.path.dirname(local_path))
-            with open(local_path, 'wb') as local_file:
-                downloader = request.execute()
-                local_file.write(downloader)
+            partial_path = local_path + PARTIAL_SUFFIX
+            if size >= self.download_threshold and self.download_connections > 1:
+                downloaded = self.drive_api.download_file_ranges(
+                    file_id, partial_path, size,
+                    connections=self.download_connections,
+                    chunk_size=self.download_chunk_size
+                )
+            else:
+                downloaded = self.drive_api.download_file(
+                    file_id, partial_path, chunk_size=self.download_chunk_size)
+            if not downloaded:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                return False
+            
+            file_hash = get_file_hash(partial_path)
+            expected_hash = drive_file.get('md5Checksum')
+            if expected_hash and file_hash != expected_hash:
+                os.remove(partial_path)
+                self.logger.error(f"Checksum mismatch downloading {drive_file['name']}, discarding")
+                return False
+            os.replace(partial_path, local_path)
                 
             self.logger.info(f"Downloaded file from Drive: {drive_file['name']}")
             
             # Update file index
             rel_path = os.path.relpath(local_path, self.local_folder)
-            self.file_index[rel_path] = {
-                'path': local_path,
-                'size': os.path.getsize(local_path),
-                'modified': os.path.getmtime(local_path),
-                'hash': get_file_hash(local_path)
-            }
+            self.file_index.set(
+                rel_path,
+                os.path.getsize(local_path),
+                os.path.getmtime(local_path),
+                file_hash
+            )
+            return True
             
         except Exception as e:
             self.logger.error(f"Error downloading from Drive: {str(e)}")
+            return False
+
+DRIVE_POLL_INTERVAL = 60
+DEFAULT_SCAN_INTERVAL = 30
+STATE_SAVE_INTERVAL = 300
+STATE_FILE = os.path.join(os.path.dirname(__file__), '..', 'sync_state.json')
+SCAN_STATE_FILE = os.path.join(os.path.dirname(__file__), '..', 'scan_state.bin')
+INDEX_STATE_FILE = os.path.join(os.path.dirname(__file__), '..', 'index_state.bin')
+JOURNAL_FILE = os.path.join(os.path.dirname(__file__), '..', 'journal.log')
 
 class SyncEngine:
-    def __init__(self, local_folder, drive_folder_name, ignore_patterns=None):
+    def __init__(self, local_folder, drive_folder_name, ignore_patterns=None,
+                 max_watches=None, scan_interval=None, download_threshold=None,
+                 download_connections=None, download_chunk_size=None, verify_dirs=None):
         self.local_folder = local_folder
         self.drive_folder_name = drive_folder_name
         self.ignore_patterns = ignore_patterns or []
+        self.max_watches = max_watches or DEFAULT_MAX_WATCHES
+        self.scan_interval = scan_interval or DEFAULT_SCAN_INTERVAL
+        self.verify_dirs = verify_dirs or DEFAULT_VERIFY_DIRS
+        self.download_threshold = download_threshold or PARALLEL_DOWNLOAD_THRESHOLD
+        self.download_connections = download_connections or DOWNLOAD_CONNECTIONS
+        self.download_chunk_size = download_chunk_size or DOWNLOAD_CHUNK_SIZE
         self.logger = logging.getLogger('drive_sync')
         self.running = False
-        self.observer = None
+        self.detector = None
+        self.journal = None
+        self.poll_requested = False
+        self.wake = threading.Event()
         
         # Set up logging
         logging.basicConfig(
@@ -202,46 +382,148 @@ class SyncEngine:
         self.creds = authenticate()
         self.drive_api = DriveAPI(self.creds)
         
-        # Get or create Drive folder
-        self.drive_folder_id = self.drive_api.get_folder_id(drive_folder_name)
+        # Reuse the Drive folder ID cached by a previous run; start() verifies it
+        self.drive_folder_id = self.load_cached_folder_id()
+        self.folder_id_verified = False
         if not self.drive_folder_id:
-            self.drive_folder_id = self.drive_api.create_folder(drive_folder_name)
-            if not self.drive_folder_id:
-                raise Exception(f"Could not create or find Drive folder: {drive_folder_name}")
-            self.logger.info(f"Created new Drive folder: {drive_folder_name}")
+            self.drive_folder_id = self.resolve_drive_folder_id()
+    
+    @classmethod
+    def from_config(cls, config):
+        """Create a sync engine from the settings in config.json"""
+        return cls(
+            local_folder=config['local_folder'],
+            drive_folder_name=config['drive_folder'],
+            ignore_patterns=config.get('ignore_patterns', []),
+            max_watches=config.get('max_watches'),
+            scan_interval=config.get('scan_interval'),
+            download_threshold=config.get('parallel_download_threshold'),
+            download_connections=config.get('download_connections'),
+            download_chunk_size=config.get('download_chunk_size'),
+            verify_dirs=config.get('verify_dirs_per_scan')
+        )
+    
+    def load_cached_folder_id(self):
+        """Get the Drive folder ID saved in local state, if any"""
+        state = load_json(STATE_FILE, {})
+        return state.get('folder_ids', {}).get(self.drive_folder_name)
+    
+    def resolve_drive_folder_id(self):
+        """Find or create the Drive folder and cache its ID in local state"""
+        folder_id = self.drive_api.get_folder_id(self.drive_folder_name)
+        if not folder_id:
+            folder_id = self.drive_api.create_folder(self.drive_folder_name)
+            if not folder_id:
+                raise Exception(f"Could not create or find Drive folder: {self.drive_folder_name}")
+            self.logger.info(f"Created new Drive folder: {self.drive_folder_name}")
+        
+        state = load_json(STATE_FILE, {})
+        state.setdefault('folder_ids', {})[self.drive_folder_name] = folder_id
+        try:
+            save_json(STATE_FILE, state)
+        except Exception as e:
+            self.logger.error(f"Error saving sync state: {str(e)}")
+        
+        self.folder_id_verified = True
+        return folder_id
+    
+    def verify_drive_folder(self, event_handler):
+        """Check a cached folder ID before the first poll, re-resolving it if it went stale
+        
+        This runs in the engine loop rather than in start(), so startup makes no
+        Drive request before replaying the journal and scanning. Polling a stale
+        folder ID would look like every remote file was deleted, so the poll is
+        skipped until the check succeeds.
+        """
+        if self.folder_id_verified:
+            return True
+        try:
+            if self.drive_api.folder_exists(self.drive_folder_id):
+                self.folder_id_verified = True
+            else:
+                self.drive_folder_id = self.resolve_drive_folder_id()
+                event_handler.drive_folder_id = self.drive_folder_id
+        except Exception as e:
+            self.logger.error(f"Error checking Drive folder: {str(e)}")
+        return self.folder_id_verified
     
     def start(self):
         """Start the sync engine"""
         self.logger.info(f"Starting sync between {self.local_folder} and Google Drive folder: {self.drive_folder_name}")
         
-        # Set up file system watcher
+        # Operations are journaled before they run so a crash doesn't lose them
+        self.journal = OperationJournal(JOURNAL_FILE, self.local_folder)
+        unfinished = self.journal.open()
+        
+        # Set up local change detection: inotify on hot directories, incremental scans elsewhere
         event_handler = SyncHandler(
             self.drive_api, 
             self.local_folder, 
             self.drive_folder_id,
-            self.ignore_patterns
+            self.ignore_patterns + [PARTIAL_SUFFIX],
+            journal=self.journal,
+            download_threshold=self.download_threshold,
+            download_connections=self.download_connections,
+            download_chunk_size=self.download_chunk_size,
+            index_file=INDEX_STATE_FILE
         )
-        self.observer = Observer()
-        self.observer.schedule(event_handler, self.local_folder, recursive=True)
-        self.observer.start()
+        # The handler starts from the index saved last run, so unfinished operations are
+        # replayed right away and the detector's first scan only has to cover what changed
+        event_handler.replay(unfinished)
+        self.detector = HybridChangeDetector(
+            event_handler,
+            self.local_folder,
+            event_handler.ignore_patterns,
+            max_watches=self.max_watches,
+            state_file=SCAN_STATE_FILE,
+            wakeup=self.wake.set,
+            verify_dirs=self.verify_dirs
+        )
+        self.detector.start()
         self.running = True
         
         try:
+            next_poll = 0
+            next_scan = time.time() + self.scan_interval
+            next_save = time.time() + STATE_SAVE_INTERVAL
             while self.running:
-                # Poll for Drive changes periodically
-                event_handler.poll_drive_changes()
-                time.sleep(60)  # Poll every minute
+                now = time.time()
+                if now >= next_poll or self.poll_requested:
+                    # Poll for Drive changes periodically or when asked to
+                    self.poll_requested = False
+                    if self.verify_drive_folder(event_handler):
+                        event_handler.poll_drive_changes()
+                    next_poll = now + DRIVE_POLL_INTERVAL
+                if now >= next_scan or self.wake.is_set():
+                    # Pick up local changes outside the watched directories
+                    self.wake.clear()
+                    self.detector.rescan()
+                    event_handler.retry_failed()
+                    next_scan = time.time() + self.scan_interval
+                if now >= next_save:
+                    # Saved periodically as well as at shutdown, so a crash loses little
+                    self.detector.save_state()
+                    event_handler.save_file_index()
+                    next_save = time.time() + STATE_SAVE_INTERVAL
+                self.wake.wait(max(0, min(next_poll, next_scan, next_save) - time.time()))
         except KeyboardInterrupt:
             self.stop()
         finally:
-            if self.observer:
-                self.observer.stop()
-                self.observer.join()
+            if self.detector:
+                self.detector.stop()
+                self.detector = None
+            event_handler.save_file_index()
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+    
+    def sync_now(self):
+        """Ask the engine loop to poll Drive right away"""
+        self.poll_requested = True
+        self.wake.set()
     
     def stop(self):
         """Stop the sync engine"""
         self.logger.info("Stopping sync engine")
         self.running = False
-        if self.observer:
-            self.observer.stop()
-            self.observer.join()
\ No newline at end of file
+        self.wake.set()
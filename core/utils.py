@@ -1,5 +1,7 @@
 import os
+import json
 import hashlib
+from contextlib import contextmanager
 
 def ensure_dir(directory):
     """Ensure that a directory exists, creating it if necessary"""
@@ -14,4 +16,46 @@ def get_file_hash(file_path, block_size=65536):
         while len(buf) > 0:
             hasher.update(buf)
             buf = f.read(block_size)
-    return hasher.hexdigest()
\ No newline at end of file
+    return hasher.hexdigest()
+
+def load_json(file_path, default=None):
+    """Load a JSON file, returning default if it is missing or unreadable"""
+    try:
+        with open(file_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def save_json(file_path, data):
+    """Atomically write data to a JSON file"""
+    with atomic_write(file_path, 'w') as f:
+        json.dump(data, f)
+
+@contextmanager
+def atomic_write(file_path, mode='wb'):
+    """Open a temporary file that replaces file_path only if writing succeeds"""
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, mode) as f:
+        yield f
+    os.replace(tmp_path, file_path)
+
+def write_state_header(f, magic, meta):
+    """Start a binary state file: magic bytes, then a line of JSON metadata"""
+    f.write(magic + b'\n')
+    f.write(json.dumps(meta).encode() + b'\n')
+
+def read_state_header(f, magic):
+    """Read the metadata written by write_state_header, or None if the file doesn't match"""
+    if f.readline() != magic + b'\n':
+        return None
+    try:
+        return json.loads(f.readline())
+    except ValueError:
+        return None
+
+def read_exact(f, size):
+    """Read exactly size bytes, raising ValueError on a truncated file"""
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("State file is truncated")
+    return data
@@ -0,0 +1,161 @@
+from multiprocessing.connection import Listener, AuthenticationError
+from collections import deque
+import os
+import logging
+import secrets
+import threading
+from .ipc import IPC_ADDRESS, IPC_FAMILY, EngineClient, acquire_worker_lock, load_authkey
+from .sync_engine import SyncEngine
+
+class EventLog(logging.Handler):
+    """Keep recent log records so IPC clients can follow engine activity"""
+
+    def __init__(self, capacity=500):
+        super().__init__(level=logging.INFO)
+        self.records = deque(maxlen=capacity)
+        self.next_id = 1
+        self.records_lock = threading.Lock()
+
+    def emit(self, record):
+        with self.records_lock:
+            self.records.append({
+                'id': self.next_id,
+                'time': record.created,
+                'level': record.levelname,
+                'message': record.getMessage()
+            })
+            self.next_id += 1
+
+    def since(self, event_id):
+        with self.records_lock:
+            return [event for event in self.records if event['id'] > event_id]
+
+class EngineWorker:
+    """Run the sync engine and serve status and control requests over IPC"""
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = logging.getLogger('drive_sync')
+        self.engine = None
+        self.engine_thread = None
+        self.error = None
+        self.stopping = False
+        self.stopped = False
+        # Event IDs restart in every worker, so clients reset their cursor when this changes
+        self.boot_id = secrets.token_hex(8)
+        self.events = EventLog()
+        self.logger.addHandler(self.events)
+
+    def run(self):
+        """Serve IPC requests until a stop command arrives and the engine has finished"""
+        # Held until this process exits, so two engines never share the state files
+        lock = acquire_worker_lock()
+        if lock is None:
+            self.logger.info("Sync engine worker already running, not starting another")
+            return
+
+        try:
+            authkey = load_authkey(create=True)
+            if IPC_FAMILY == 'AF_UNIX' and os.path.exists(IPC_ADDRESS):
+                # Left behind by a worker that didn't shut down cleanly; safe to remove under the lock
+                os.remove(IPC_ADDRESS)
+            listener = Listener(IPC_ADDRESS, family=IPC_FAMILY, authkey=authkey)
+
+            self.engine_thread = threading.Thread(target=self.run_engine, daemon=True)
+            self.engine_thread.start()
+
+            try:
+                # Keeps answering (status 'stopping') until the engine thread is done
+                while not self.stopped:
+                    try:
+                        conn = listener.accept()
+                    except (OSError, EOFError, AuthenticationError) as e:
+                        if not self.stopped:
+                            self.logger.warning(f"Rejected IPC connection: {str(e)}")
+                        continue
+                    threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+            finally:
+                listener.close()
+                self.engine_thread.join()
+        finally:
+            lock.close()
+
+    def run_engine(self):
+        try:
+            engine = SyncEngine.from_config(self.config)
+            if self.stopping:
+                return
+            self.engine = engine
+            self.engine.start()
+        except Exception as e:
+            self.error = str(e)
+            self.logger.error(f"Sync engine failed: {str(e)}")
+
+    def serve(self, conn):
+        """Answer requests on one client connection"""
+        with conn:
+            try:
+                while True:
+                    request = conn.recv()
+                    conn.send(self.handle(request))
+            except (OSError, EOFError):
+                pass
+
+    def handle(self, request):
+        command = request.get('command')
+        try:
+            if command == 'ping':
+                return {'pid': os.getpid()}
+            if command == 'status':
+                return self.status()
+            if command == 'events':
+                since = request.get('since', 0)
+                if request.get('boot_id') not in (None, self.boot_id):
+                    since = 0
+                return {'boot_id': self.boot_id, 'events': self.events.since(since)}
+            if command == 'sync_now':
+                if self.stopping:
+                    return {'error': 'Sync engine stopping'}
+                if not self.engine:
+                    return {'error': 'Sync engine not started'}
+                self.engine.sync_now()
+                return {'message': 'Manual sync triggered'}
+            if command == 'stop':
+                self.shutdown()
+                return {'message': 'Sync engine stopping'}
+            return {'error': f"Unknown command: {command}"}
+        except Exception as e:
+            return {'error': str(e)}
+
+    def status(self):
+        if self.stopping:
+            status = 'stopping'
+        elif self.error:
+            status = 'error'
+        elif self.engine and self.engine.running:
+            status = 'running'
+        else:
+            status = 'starting'
+        return {
+            'status': status,
+            'pid': os.getpid(),
+            'local_folder': self.config.get('local_folder'),
+            'drive_folder': self.config.get('drive_folder'),
+            'message': self.error
+        }
+
+    def shutdown(self):
+        if self.stopping:
+            return
+        self.stopping = True
+        if self.engine:
+            self.engine.stop()
+        threading.Thread(target=self.finish_shutdown, daemon=True).start()
+
+    def finish_shutdown(self):
+        """Wait for the engine to finish, then let run() close the listener"""
+        if self.engine_thread:
+            self.engine_thread.join()
+        self.stopped = True
+        # Wake the accept loop so run() can return
+        EngineClient().is_running()
@@ -1,6 +1,8 @@
 // Global variables
 let syncStatus = 'stopped';
 let lastSyncTime = null;
+let lastEventId = 0;
+let engineBootId = null;
 
 // DOM elements
 const statusDot = document.getElementById('statusDot');
@@ -26,6 +28,7 @@ document.addEventListener('DOMContentLoaded', function() {
     updateStatus();
     checkAuthStatus();
     setInterval(updateStatus, 5000); // Update status every 5 seconds
+    setInterval(updateEvents, 5000); // Pull engine activity every 5 seconds
     setInterval(checkAuthStatus, 10000); // Check auth status every 10 seconds
 });
 
@@ -64,14 +67,30 @@ async function updateStatus() {
         syncStatus = status.status;
         
         // Update status indicator
+        statusDot.classList.toggle('running', status.status === 'running');
+        statusDot.classList.toggle('starting', status.status === 'starting' || status.status === 'stopping');
+        statusText.title = '';
         if (status.status === 'running') {
-            statusDot.classList.add('running');
             statusText.textContent = 'Running';
             startBtn.disabled = true;
             stopBtn.disabled = false;
             syncBtn.disabled = false;
+        } else if (status.status === 'stopping') {
+            // Finishing in-flight work; Start is refused until the worker exits
+            statusText.textContent = 'Stopping...';
+            startBtn.disabled = true;
+            stopBtn.disabled = true;
+            syncBtn.disabled = true;
+        } else if (status.status === 'starting' || status.status === 'error') {
+            // The worker process is up, so it has to be stopped before starting again
+            statusText.textContent = status.status === 'starting' ? 'Starting...' : 'Error';
+            if (status.status === 'error' && status.message) {
+                statusText.title = status.message;
+            }
+            startBtn.disabled = true;
+            stopBtn.disabled = false;
+            syncBtn.disabled = true;
         } else {
-            statusDot.classList.remove('running');
             statusText.textContent = 'Stopped';
             startBtn.disabled = false;
             stopBtn.disabled = true;
@@ -91,6 +110,39 @@ async function updateStatus() {
     }
 }
 
+// Show new activity reported by the sync engine
+async function updateEvents() {
+    try {
+        let url = `/api/events?since=${lastEventId}`;
+        if (engineBootId) {
+            url += `&boot_id=${encodeURIComponent(engineBootId)}`;
+        }
+        const response = await fetch(url);
+        const result = await response.json();
+        
+        // Event IDs start over in every new worker process
+        if (result.boot_id && result.boot_id !== engineBootId) {
+            engineBootId = result.boot_id;
+            lastEventId = 0;
+        }
+        
+        result.events.forEach(event => {
+            lastEventId = event.id;
+            addActivityLog(escapeHtml(event.message));
+        });
+        
+    } catch (error) {
+        console.error('Error updating events:', error);
+    }
+}
+
+// Escape text before it is inserted as HTML
+function escapeHtml(text) {
+    const element = document.createElement('div');
+    element.textContent = text;
+    return element.innerHTML;
+}
+
 // Start sync
 startBtn.addEventListener('click', async function() {
     try {
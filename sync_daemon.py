@@ -3,8 +3,8 @@ import threading
 import os
 import sys
 import logging
-from core.sync_engine import SyncEngine
-from ui.tray import create_tray_icon
+from core.ipc import EngineClient
+from core.worker import EngineWorker
 
 def load_config():
     """Load configuration from config.json"""
@@ -38,20 +38,29 @@ def main():
         logger.error(f"Local folder does not exist: {config['local_folder']}")
         sys.exit(1)
     
-    # Initialize sync engine
-    sync_engine = SyncEngine(
-        local_folder=config['local_folder'],
-        drive_folder_name=config['drive_folder'],
-        ignore_patterns=config.get('ignore_patterns', [])
-    )
+    # The engine runs in this process and is controlled over the IPC channel,
+    # so the web UI can attach to it as well
+    worker = EngineWorker(config)
+    
+    # The tray pulls in pystray and PIL, so only import it when there is a desktop
+    create_tray_icon = None
+    if '--headless' not in sys.argv:
+        try:
+            from ui.tray import create_tray_icon
+        except Exception as e:
+            logger.info(f"System tray unavailable, running headless: {str(e)}")
+    
+    if create_tray_icon is None:
+        worker.run()
+        return
     
-    # Start sync engine in a separate thread
-    sync_thread = threading.Thread(target=sync_engine.start)
-    sync_thread.daemon = True
-    sync_thread.start()
+    # Serve the engine in a separate thread
+    worker_thread = threading.Thread(target=worker.run)
+    worker_thread.daemon = True
+    worker_thread.start()
     
     # Create and run system tray icon
-    icon = create_tray_icon(sync_engine)
+    icon = create_tray_icon(EngineClient())
     icon.run()
 
 if __name__ == "__main__":
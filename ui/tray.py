@@ -3,8 +3,8 @@ from PIL import Image
 import threading
 import logging
 
-def create_tray_icon(sync_engine):
-    """Create a system tray icon for the sync application"""
+def create_tray_icon(engine_client):
+    """Create a system tray icon that controls the sync engine over IPC"""
     logger = logging.getLogger('drive_sync')
     
     # Create a simple icon (you can replace this with your own icon file)
@@ -13,11 +13,15 @@ def create_tray_icon(sync_engine):
     def on_sync_clicked(icon, item):
         """Handle sync now menu item click"""
         logger.info("Manual sync triggered")
-        threading.Thread(target=sync_engine.poll_drive_changes).start()
+        threading.Thread(target=engine_client.sync_now).start()
     
     def on_exit_clicked(icon, item):
         """Handle exit menu item click"""
         logger.info("Exiting sync application")
+        try:
+            engine_client.stop()
+        except Exception as e:
+            logger.error(f"Error stopping sync engine: {str(e)}")
         icon.stop()
     
     # Create the menu